@@ -7,16 +7,17 @@ CALculations CONtrol
 import sys
 import os
 import json
-import math
 import time
 from importlib import import_module
-from numpy import base_repr # for compacting hash string
-import hashlib
-from shutil import rmtree
+# `hashlib`, `shutil` and (optional) `orjson` are imported where needed,
+# since they are only used when configurations are loaded / cached steps
+# are run / json files are read
 
 # Constants
 temp_step_folder = "_temp_step"
 """Folder name where step results are stored before renaming to permanent"""
+old_step_folder = "_old_step"
+"""Folder name where replaced step results are moved before removal"""
 step_config_fname = "_config"
 """File name where step's config is saved"""
 step_stats_fname = "_stats"
@@ -45,7 +46,7 @@ iname_non_cached = "_noncached"
 
 # sys_params_set = {pname_seq,pname_invar,pname_timed,pname_nontimed}
 # """Set of system parameter names"""
-sys_params_hashed_set = {pname_seq,pname_timed}
+sys_params_hashed_set = frozenset({pname_seq,pname_timed})
 """Set of system parameter names which are included in hash"""
 
 return_stats_key = "_stats"
@@ -53,6 +54,16 @@ return_stats_key = "_stats"
 return_res_key = "_result"
 """Key name containing output returned by routines"""
 stats_timing_key = "_time"
+_orjson = None
+"""`orjson` module for faster json parsing, imported on first use
+(False if it is not installed)"""
+_hash_digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+"""Digits of the base-36 representation of hashes (cache folder names)"""
+_hash_digit_pairs = [di+dj for di in _hash_digits for dj in _hash_digits]
+"""Pairs of base-36 digits indexed by their value 0..36**2-1"""
+_hash_encoder = json.JSONEncoder(sort_keys=True,check_circular=False)
+"""Encoder of dicts to be hashed, reused instead of one per `json.dumps`
+(configurations are trees, so checking for circular references is skipped)"""
 
 
 def _str_key(arg):
@@ -71,6 +82,14 @@ def _list_val(arg):
         return []
     return _force_list(next(iter(arg.values())))
 
+def _intern(arg):
+    """
+    If the arg is a str, returns its interned version, otherwise returns arg
+    """
+    if isinstance(arg,str):
+        return sys.intern(arg)
+    return arg
+
 def _list2tuple(arg):
     """
     If the arg is a list, converts it to tuple, otherwise returns arg
@@ -92,12 +111,12 @@ def _fn_normalize(fname,folder,ext):
     Given file name, folder and extension, 
     makes file name relative to the folder if possible, and
     adds the extension if there is no one
+    `fname` may also be a path-like object.
     """
-    if os.path.splitext(fname)[1]:
-        ext = ""
-    elif ext and ext[0]!=".":
-        ext = "."+ext
-    return os.path.join(folder,fname)+ext
+    fname = os.fspath(fname)
+    if ext and not os.path.splitext(fname)[1]:
+        fname += ext if ext[0]=="." else "."+ext
+    return os.path.join(folder,fname)
 
 def _force_list(arg):
     """
@@ -110,8 +129,10 @@ def _force_list(arg):
 ## Converts the given dictionary to string invariant to keys order
 #   - the dictoinary can be nested and include lists
 #   - all keys at any level should be string
+#   - the output is the same as `json.dumps(dct,sort_keys=True)`, which
+#     defines cached folders' names
 def _dict2str(dct):
-    return json.dumps(dct,sort_keys=True)
+    return _hash_encoder.encode(dct)
 
 # Given dct as dict or None; add_dct as dict or None:
 #    safely updates dct with add_dct
@@ -129,25 +150,47 @@ def _nonempty_dict(dct,add_dct):
 #   - if both l_yes and l_no are None, all the elements are True
 def _yes_no_dict(l,l_yes,l_no):
     if l_yes is not None:
-        dct = {ki:False for ki in l}
-        dct.update({ki: True for ki in l_yes})
+        dct = dict.fromkeys(l,False)
+        dct.update(dict.fromkeys(l_yes,True))
     else:
-        dct = {ki:True for ki in l}
+        dct = dict.fromkeys(l,True)
         if l_no is not None:
-            dct.update({ki: False for ki in l_no})
+            dct.update(dict.fromkeys(l_no,False))
     return dct
 
+## Parses json given as bytes or str, using `orjson` if available
+#   - falls back to `json` e.g. for NaN or big integers, which `json.dump`
+#     writes but `orjson` rejects
+def _json_loads(data):
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson as _orjson
+        except ImportError:
+            _orjson = False
+    if _orjson:
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
 ## Calculates unique hash for a string, returns str
+#   - the digest is written in base 36, most significant digit first,
+#     two digits at a time
 def _str2hash(string):
-    return base_repr(
-        int(
-            hashlib.shake_128(
-                bytearray(string,"utf-8")
-            ).hexdigest(10),
-            16
-        ),
-        base=36
+    import hashlib
+    num = int.from_bytes(
+        hashlib.shake_128(string.encode("utf-8")).digest(10),
+        "big"
         )
+    digits = []
+    while num >= 36:
+        num, d = divmod(num,1296)
+        digits.append(_hash_digit_pairs[d])
+    if num:
+        digits.append(_hash_digits[num])
+    return "".join(reversed(digits)) or "0"
 ## Calculates hash for a given dict
 def _dict2hash(dct):
     return _str2hash(_dict2str(dct))
@@ -159,7 +202,9 @@ def _hook(r_name):
     if len(l)==1:
         module = sys.modules[main_scope]
     else:
-        module = sys.modules.get( l[0], import_module(l[0]) ) 
+        module = sys.modules.get(l[0])
+        if module is None: # imported only if not yet
+            module = import_module(l[0])
     return getattr(module, func_name)
 
 class calcon:
@@ -180,8 +225,9 @@ class calcon:
               "_noncached": list of non-cached routine names
                   * "_noncached" works only if "_cached" is missing
                   * by default, all routines are cached
-            * str: name of `json` file containing the above dict, optionally
-              containing path relative to `calc_folder` or absolute path
+            * str or path-like: name of `json` file containing the above
+              dict, optionally containing path relative to `calc_folder`
+              or absolute path
                   * if the extension is missing, it is set to `.json`
                   * by default, the file is in 
                     `<calc_folder>/<dfl_r_init_fname>`
@@ -215,15 +261,23 @@ class calcon:
         self._calc_folder = calc_folder
         self._conf_subfolder = configs_subfolder
         self._temp_folder = os.path.join(calc_folder,temp_step_folder)
+        self._old_folder = os.path.join(calc_folder,old_step_folder)
+        self._temp_config_path = _fn_normalize(
+            step_config_fname,self._temp_folder,"json"
+            )
         # Reading routines parameters if needed
-        if isinstance(routines_params,str):
+        if isinstance(routines_params,(str,os.PathLike)):
             routines_params = self._read_json(routines_params)
         # Collecting dicts of sets of routines' parameters and cached info
+        # (parameter sets are only read after init, so they are frozen;
+        # names are interned, as they are used as keys in many dicts/sets)
         self._r_params = {}
         cached_info = {iname_cached:None,iname_non_cached:None}
         for li in routines_params:
             if isinstance(li,list):
-                self._r_params[_list2tuple(li[0])] = set(li[1:])
+                self._r_params[_intern(_list2tuple(li[0]))] = frozenset(
+                    map(_intern,li[1:])
+                    )
                 # _list2tuple is applied to routine names for non-implemented
                 # functionality, when a routine name may be given as 
                 # ["module.object_name","method_name"]
@@ -252,29 +306,9 @@ class calcon:
             os.path.join(self._calc_folder,subfolder),
             ".json"
             )
-        with open(fname) as f:
-            return json.load(f)
+        with open(fname,"rb") as f:
+            return _json_loads(f.read())
     
-    def _inclusion_list(self,step_nr,lst):
-        """
-        Recursively updates boolean list: True for given step and ancestors
-        """
-        lst[step_nr] = True
-        for si in self._seq[step_nr]:
-            self._inclusion_list(si,lst)
-    def _subsequence(self,step_nr):
-        """
-        Given step nr in `self._seq`, returns subsequence of `self._seq` 
-        up to the nr, including only the step and its ancestors,
-        keeping the original order 
-        """
-        incl_list = [False for _ in range(step_nr+1)]
-        self._inclusion_list(step_nr,incl_list)
-        return [
-            self._s_names[i] if len(di) == 0 else
-            {self._s_names[i]: [self._s_names[j] for j in di]}
-            for i, (di,qi) in enumerate(zip(self._seq,incl_list)) if qi
-            ]
     def _get_step_params(self,step_nr):
         """
         Given step number, returns the set of its routine's parameters
@@ -283,21 +317,26 @@ class calcon:
     
     def load_config(self,config):
         """
-        Given master configuration as `dict` or `str` (config. file name),
+        Given master configuration as `dict` or `str` / path-like
+        (config. file name),
         checks its consistency and prepares calculation plan.
         """
-        if isinstance(config,str):
+        if isinstance(config,(str,os.PathLike)):
             config = self._read_json(config,self._conf_subfolder)
         ## The calculations plan and steps names 
         # (by default, has one step "Main")
         seq_str = config.get(pname_seq, [dfl_step_name])
+        # Sequence elements as (step name, list of parent names)
+        seq_norm = [(sys.intern(_str_key(si)), _list_val(si)) for si in seq_str]
         # List of step names in the order of the sequence
-        self._s_names = [_str_key(si) for si in seq_str]
+        self._s_names = [si for si,_ in seq_norm]
+        # Names of steps' routine selection parameters
+        self._s_pnames = [sys.intern(step_prefix+si) for si in self._s_names]
         # The number of steps
         self._n = n = len(seq_str)
         # Initialize the collections of results and summary statistics
-        self._res = [None for _ in range(self._n)]
-        self._stats = [None for _ in range(self._n)]
+        self._res = [None]*n
+        self._stats = [None]*n
         # Consistency check: all steps names should be different
         if self._n > len(set(self._s_names)):
             raise Exception(
@@ -308,16 +347,9 @@ class calcon:
         # The main sequence as a list, where #element = #step,
         #   element = list of parent #steps
         self._seq = [
-            [ self._s_nrs[sj] for sj in _list_val(si) ]
-                    for si in seq_str
+            [ self._s_nrs[sj] for sj in li ]
+                    for _,li in seq_norm
             ]
-        # Consistency check: each step should go after its ancestors
-        for i, li in enumerate(self._seq):
-            if len(li)>0 and max(li)>=i:
-                raise Exception(
-                "Each step should go after its ancestors, not like",
-                    seq_str[i]
-                )
         # Information which steps should be timed
         if_timed_dct = _yes_no_dict(
             self._s_names,
@@ -336,87 +368,129 @@ class calcon:
         self._s_hash_params = [set() for _ in range(n)]
         # Step's subsequence in str form
         self._s_seq = [[] for _ in range(n)]
-        # Step's routine name
-        self._s_routine = ["" for _ in range(n)]
+        # Numbers of the step and its ancestors (only needed while loading)
+        s_ancestors = [set() for _ in range(n)]
+        # Elements of the sequence in str form, as used in subsequences
+        seq_elems = [
+            si if len(li) == 0 else {si: list(li)}
+            for si,li in seq_norm
+            ]
+        # Step's routine name and function
+        self._s_routine = [""]*n
+        self._s_routine_fn = [None]*n
         # If step is cached (boolean)
-        self._s_if_cached = [True for _ in range(n)]
+        self._s_if_cached = [True]*n
         # Cached folder name / full path if exists
-        self._s_cached_folder = [None for _ in range(n)]
-        self._s_cached_path = [None for _ in range(n)]
+        self._s_cached_folder = [None]*n
+        self._s_cached_path = [None]*n
+        # Full path of the stats file in the cached folder
+        self._s_stats_path = [None]*n
         # Shortening for invariant set
         invar_set = set(_force_list(config.get(pname_invar,[])))
+        # Sorted once; steps' invariant lists are filtered from it in order
+        # (only str entries can match parameter names)
+        invar_sorted = sorted(ki for ki in invar_set if isinstance(ki,str))
+        # Values of all parameters that may enter steps' configurations
+        # (routines' and $-parameters; None if absent in the configuration)
+        p_vals = {
+            ki:config.get(ki,None) for ki in set().union(
+                *self._r_params.values(),
+                self._s_pnames
+                )
+            }
         for i,isp in enumerate(self._seq): # isp is parents of step (#i)
-            step_name = self._s_names[i]
+            s_pname = self._s_pnames[i]
             # Creating supplementary step information
-            self._s_seq[i] = subseq = self._subsequence(i)
-            self._s_routine[i] = s_routine = _list2tuple(
-                config[step_prefix+step_name]
-                )
+            # (ancestors of parents are already known, as they go before)
+            s_ancestors[i] = s_anc = {i}
+            for j in isp:
+                # Consistency check: each step should go after its ancestors
+                if j >= i:
+                    raise Exception(
+                    "Each step should go after its ancestors, not like",
+                        seq_str[i]
+                    )
+                s_anc |= s_ancestors[j]
+            self._s_seq[i] = subseq = [seq_elems[j] for j in sorted(s_anc)]
+            self._s_routine[i] = s_routine = _intern(_list2tuple(
+                config[s_pname]
+                ))
+            self._s_routine_fn[i] = self._routines[s_routine]
             self._s_if_cached[i] = s_if_cached = self._r_caching[s_routine]
-            self._s_params[i] = s_params = set.union(
-                set([step_prefix+step_name]),
-                self._r_params[s_routine],
-                *[self._s_params[j] for j in isp]
-                )
-            self._s_invar[i] = s_invar = invar_set & (
-                s_params | sys_params_hashed_set
-                )
-            self._s_hash_params[i] = s_hash_params = (
-                s_params | sys_params_hashed_set
-                ) - invar_set
+            self._s_params[i] = s_params = {s_pname}
+            s_params |= self._r_params[s_routine]
+            for j in isp:
+                s_params |= self._s_params[j]
+            # Step's parameters together with hashed system parameters
+            s_params_sys = s_params | sys_params_hashed_set
+            s_invar_sorted = [ki for ki in invar_sorted if ki in s_params_sys]
+            self._s_invar[i] = set(s_invar_sorted)
+            self._s_hash_params[i] = s_hash_params = s_params_sys - invar_set
             # Creating step's configuration
             self._s_config[i] = s_config = {
-                ki:config.get(ki,None) for ki in s_params
+                ki:p_vals[ki] for ki in s_params
                 }
             s_config[pname_seq] = subseq
-            if len(s_invar) > 0:
-                s_config[pname_invar] = sorted(list(s_invar))
+            if len(s_invar_sorted) > 0:
+                s_config[pname_invar] = s_invar_sorted
             s_config[pname_timed] = self._s_if_timed[i]
             # Cached folder name
+            # (all hashed parameters are in step's config by construction)
             if s_if_cached:
                 self._s_cached_folder[i] = cached = _dict2hash(
-                        {
-                        ki:vi for ki,vi in s_config.items()
-                            if ki in s_hash_params
-                        }
+                        {ki:s_config[ki] for ki in s_hash_params}
+                    )
+                self._s_cached_path[i] = c_path = os.path.join(
+                    self._calc_folder,cached
+                    )
+                self._s_stats_path[i] = _fn_normalize(
+                    step_stats_fname,c_path,"json"
                     )
-                self._s_cached_path[i] = os.path.join(self._calc_folder,cached)
     # Prepares a new temp folder for step calculation with step's config file
     def _make_step_folder(self,s_nr):
-        if os.path.exists(self._temp_folder):
+        from shutil import rmtree
+        try:
             rmtree(self._temp_folder)
+        except FileNotFoundError:
+            pass
         os.mkdir(self._temp_folder)
-        with open(
-            _fn_normalize(step_config_fname,self._temp_folder,"json"),"w"
-                ) as f:
-            json.dump(self._s_config[s_nr],f)
+        with open(self._temp_config_path,"w") as f:
+            f.write(json.dumps(self._s_config[s_nr]))
     # After step's calculation ends successfuly, renames the temp folder to
-    # its intended name
+    # its intended name. If the folder already exists, it is moved aside
+    # and removed only after the new one is in place
     def _checkin_step_folder(self,s_nr):
-        if os.path.exists(self._s_cached_path[s_nr]):
-            rmtree(self._s_cached_path[s_nr])
-        os.rename(self._temp_folder,self._s_cached_path[s_nr])
+        from shutil import rmtree
+        path = self._s_cached_path[s_nr]
+        try:
+            os.replace(self._temp_folder,path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            try:
+                rmtree(self._old_folder)
+            except FileNotFoundError:
+                pass
+            os.replace(path,self._old_folder)
+            os.replace(self._temp_folder,path)
+            rmtree(self._old_folder)
     # Check if there is a cached folder for the given step nr.
     # If yes, collects the saved stats, sets rezult as folder name
     #   and returns True, otherwise False
+    #   (a folder without saved stats, e.g. after an interrupted check-in,
+    #   counts as missing; stats are always saved right after check-in)
     def _try_step_folder(self,s_nr):
-        if os.path.exists(self._s_cached_path[s_nr]):
-            self._stats[s_nr] = self._read_json(
-                step_stats_fname,self._s_cached_folder[s_nr]
-                )
-            self._res[s_nr] = self._s_cached_path[s_nr]
-            return True
-        return False
+        try:
+            with open(self._s_stats_path[s_nr],"rb") as f:
+                self._stats[s_nr] = _json_loads(f.read())
+        except FileNotFoundError:
+            return False
+        self._res[s_nr] = self._s_cached_path[s_nr]
+        return True
     # Saves summary statistics of the given step to the cache folder
     def _save_stats_json(self,s_nr):
-        with open(
-                os.path.join(
-                    self._s_cached_path[s_nr],
-                    step_stats_fname
-                    )+".json",
-                "w"
-                ) as f:
-            json.dump(self._stats[s_nr],f)
+        with open(self._s_stats_path[s_nr],"w") as f:
+            f.write(json.dumps(self._stats[s_nr]))
             
     def run_step(self,s_nr):
         """
@@ -429,7 +503,8 @@ class calcon:
         stats_internal = {} # addition to statistics
         if q_cached and self._try_step_folder(s_nr):
             return False
-        args = [self._res[si] for si in self._seq[s_nr]]
+        res = self._res
+        args = [res[si] for si in self._seq[s_nr]]
         if q_cached:
             self._make_step_folder(s_nr)
             args.append(self._temp_folder)
@@ -437,25 +512,25 @@ class calcon:
         if q_timed:
             _time = time.process_time()
         try:
-            val = self._routines[self._s_routine[s_nr]](*args)
+            val = self._s_routine_fn[s_nr](*args)
         except Exception as exc:
             return exc
         if q_timed:
             _time = time.process_time() - _time
             stats_internal[stats_timing_key] = _time
         if q_cached:
-            self._res[s_nr] = self._s_cached_path[s_nr]
+            res[s_nr] = self._s_cached_path[s_nr]
             self._stats[s_nr] = _nonempty_dict(val,stats_internal)
             self._checkin_step_folder(s_nr)
             self._save_stats_json(s_nr)
         else:
             if isinstance(val,dict) and return_stats_key in val:
-                self._res[s_nr] = val.get(return_res_key,None)
+                res[s_nr] = val.get(return_res_key,None)
                 self._stats[s_nr] = _nonempty_dict(
                     val[return_stats_key], stats_internal
                     )
             else:
-                self._res[s_nr] = val
+                res[s_nr] = val
                 self._stats[s_nr] = _nonempty_dict({},stats_internal)
         return False
     
@@ -463,12 +538,12 @@ class calcon:
         """
         Runs the calculations, provided that configuration was already loaded
         """
+        run_step = self.run_step
         for si in range(self._n):
-            err = self.run_step(si)
+            err = run_step(si)
             if err:
                 print(f"Error in step {si} ({self._s_names[si]})")
                 return [si,err]
-                break
         return -1
     
     def get_stats(self,numbering=True):
@@ -478,15 +553,21 @@ class calcon:
         If numbering=True, steps' numbers are added in front of names.
         
         """
-        n_digits = math.ceil(math.log(self._n+1,10))
+        n_digits = len(str(self._n))
         stats={}
         for i,si in enumerate(self._stats):
             if si is not None:
                 s_name = self._s_names[i]
                 if numbering:
-                    s_name = f"({str(i).zfill(n_digits)}) {s_name}"
+                    s_name = f"({i:0{n_digits}d}) {s_name}"
                 stats[s_name] = si
         return stats
     
-    def get_result(self):
-        return self._res.copy()
+    def get_result(self,copy=True):
+        """
+        Returns the list of steps' results (None for steps not calculated).
+        If copy=False, the internal list is returned without copying;
+        it is overwritten by subsequent calculations and should not be
+        modified.
+        """
+        return list(self._res) if copy else self._res